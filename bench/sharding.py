@@ -0,0 +1,209 @@
+"""Throughput and latency of sharded update processing against a local fake Bot API.
+
+Every update is a /start from one of ``--chats`` admin chats; the fake server
+answers sendMessage after ``--latency`` seconds to emulate a slow upstream.
+``0`` workers is the plain single-process Dispatcher and serves as the baseline.
+
+Two scenarios run: all chats alike, and one slow chat whose messages block the
+handling process for ``--slow-seconds`` each (as a synchronous or CPU-heavy
+handler would). Throughput counts from the first update handed out by
+getUpdates to the last reply; latency is measured from getUpdates handing an
+update out to the reply in its chat, over all chats but the slow one.
+
+    python -m bench.sharding --workers 0 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import deque
+
+from aiohttp import web
+
+_TOKEN = "42:bench"
+_SLOW_CHAT_ID = 1
+# The handlers' router can only be attached to one Dispatcher per process.
+_single_dispatcher = None
+
+
+class FakeBotApi:
+    def __init__(self, chats: int, per_chat: int, latency: float, clients: int, first_update_id: int) -> None:
+        self.latency = latency
+        # Updates are held back until every polling client has called getMe,
+        # so worker start-up time stays out of the measurement.
+        self.clients = clients
+        self.ready_clients = 0
+        self.ready = asyncio.Event()
+        self.total = chats * per_chat
+        self.updates = [
+            {
+                "update_id": first_update_id + index,
+                "message": {
+                    "message_id": index + 1,
+                    "date": 0,
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+                    "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                },
+            }
+            for index, chat_id in enumerate(
+                chat_id for _ in range(per_chat) for chat_id in range(1, chats + 1)
+            )
+        ]
+        self.served_ids: set[int] = set()
+        # Per chat, when each of its unanswered updates was handed out.
+        self.served_at: dict[int, deque[float]] = {}
+        self.latencies: dict[int, list[float]] = {}
+        self.first_served_at = 0.0
+        self.sent = 0
+        self.last_sent_at = 0.0
+        self.done = asyncio.Event()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        if method == "getUpdates":
+            return await self._get_updates(int(data.get("offset") or 0))
+        if method == "sendMessage":
+            return await self._send_message(int(data["chat_id"]), str(data["text"]))
+        if method == "getMe":
+            self.ready_clients += 1
+            if self.ready_clients >= self.clients:
+                self.ready.set()
+            me = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+            return web.json_response({"ok": True, "result": me})
+        return web.json_response({"ok": True, "result": True})
+
+    async def _get_updates(self, offset: int) -> web.Response:
+        pending = [u for u in self.updates if u["update_id"] >= offset][:100] if self.ready.is_set() else []
+        if not pending:
+            await asyncio.sleep(0.5)
+        now = time.perf_counter()
+        if pending and not self.first_served_at:
+            self.first_served_at = now
+        for update in pending:
+            if update["update_id"] not in self.served_ids:
+                self.served_ids.add(update["update_id"])
+                self.served_at.setdefault(update["message"]["chat"]["id"], deque()).append(now)
+        return web.json_response({"ok": True, "result": pending})
+
+    async def _send_message(self, chat_id: int, text: str) -> web.Response:
+        await asyncio.sleep(self.latency)
+        now = time.perf_counter()
+        # Every update gets one reply and chats are answered in order.
+        served_at = self.served_at.get(chat_id)
+        if served_at:
+            self.latencies.setdefault(chat_id, []).append(now - served_at.popleft())
+        self.sent += 1
+        self.last_sent_at = now
+        if self.sent >= self.total:
+            self.done.set()
+        message = {"message_id": self.sent, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": text}
+        return web.json_response({"ok": True, "result": message})
+
+
+async def _slow_chat_middleware(handler, event, data):
+    if event.chat.id == _SLOW_CHAT_ID:
+        # Blocks the whole process, not just this chat.
+        time.sleep(float(os.environ.get("BENCH_SLOW_SECONDS", "0")))
+    return await handler(event, data)
+
+
+def _install_slow_chat_middleware() -> None:
+    from src.handlers import router
+
+    router.message.outer_middleware(_slow_chat_middleware)
+
+
+async def run_once(
+    workers: int, chats: int, per_chat: int, latency: float, port: int, first_update_id: int
+) -> tuple[float, list[float]]:
+    from src.main import create_bot, create_dispatcher
+    from src.sharding import run_sharded_polling
+
+    api = FakeBotApi(chats, per_chat, latency, max(1, workers), first_update_id)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+
+    global _single_dispatcher
+    if workers:
+        polling = asyncio.create_task(run_sharded_polling(create_bot(), workers))
+    else:
+        _single_dispatcher = _single_dispatcher or create_dispatcher()
+        polling = asyncio.create_task(_single_dispatcher.start_polling(create_bot(), handle_signals=False))
+    try:
+        await api.done.wait()
+    finally:
+        if workers:
+            polling.cancel()
+        else:
+            await _single_dispatcher.stop_polling()
+        try:
+            await polling
+        except asyncio.CancelledError:
+            pass
+        await runner.cleanup()
+
+    other_latencies = [
+        value for chat_id, values in api.latencies.items() if chat_id != _SLOW_CHAT_ID for value in values
+    ]
+    return api.total / (api.last_sent_at - api.first_served_at), other_latencies
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4, 8])
+    parser.add_argument("--chats", type=int, default=16)
+    parser.add_argument("--per-chat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--slow-seconds", type=float, default=0.1)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["TOKEN"] = _TOKEN
+    os.environ["ADMIN_IDS"] = str(list(range(1, args.chats + 1)))
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{args.port}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    print(f"cpus: {os.cpu_count()}, chats: {args.chats}, updates per chat: {args.per_chat}")
+    run = 0
+    with tempfile.TemporaryDirectory() as state_dir:
+        # One store for all runs (spawned workers read it from the environment);
+        # update ids never repeat, so deduplication does not drop later runs.
+        os.environ["STATE_DB"] = os.path.join(state_dir, "state.db")
+        # Imports the settings, so only once the environment is complete.
+        _install_slow_chat_middleware()
+        for title, slow_seconds in (("all chats alike", 0.0), (f"chat {_SLOW_CHAT_ID} slow", args.slow_seconds)):
+            os.environ["BENCH_SLOW_SECONDS"] = str(slow_seconds)
+            print(f"\n{title}")
+            print(f"{'workers':>7}  {'updates/s':>10}  {'speedup':>7}  {'p50 ms':>7}  {'p95 ms':>7}")
+            baseline = None
+            for workers in args.workers:
+                first_update_id = run * args.chats * args.per_chat + 1
+                run += 1
+                throughput, latencies = await run_once(
+                    workers, args.chats, args.per_chat, args.latency, args.port, first_update_id
+                )
+                baseline = baseline or throughput
+                p50 = statistics.median(latencies) * 1000
+                p95 = statistics.quantiles(latencies, n=20)[-1] * 1000
+                label = workers or "single"
+                print(
+                    f"{label:>7}  {throughput:>10.1f}  {throughput / baseline:>6.2f}x  "
+                    f"{p50:>7.0f}  {p95:>7.0f}"
+                )
+
+
+# Spawned workers import this module as __mp_main__ and need the middleware too.
+if __name__ == "__mp_main__":
+    _install_slow_chat_middleware()
+
+if __name__ == "__main__":
+    asyncio.run(main())
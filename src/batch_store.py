@@ -0,0 +1,298 @@
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import wraps
+from typing import ParamSpec, TypeVar
+
+from aiogram import types
+
+from src.config import settings
+
+_PROCESSED_UPDATES_TTL_SECONDS = 24 * 60 * 60
+_DISK_COMMITMENT_TTL_SECONDS = 24 * 60 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_batches (
+    group_key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    owner_user_id INTEGER NOT NULL,
+    files TEXT NOT NULL,
+    prompt_message_id INTEGER,
+    created_at REAL NOT NULL,
+    last_update_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    processed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_updates (
+    update_id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS disk_free (
+    device INTEGER PRIMARY KEY,
+    free_bytes INTEGER NOT NULL,
+    observed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS disk_commitments (
+    id INTEGER PRIMARY KEY,
+    device INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    committed_at REAL NOT NULL
+);
+"""
+
+
+_P = ParamSpec("_P")
+_R = TypeVar("_R")
+
+
+def _locked(method: Callable[_P, _R]) -> Callable[_P, _R]:
+    @wraps(method)
+    def wrapper(*args: _P.args, **kwargs: _P.kwargs) -> _R:
+        with args[0]._lock:
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+@dataclass
+class PendingBatch:
+    chat_id: int
+    owner_user_id: int
+    group_key: str
+    files: list[types.Document]
+    prompt_message_id: int | None = None
+    created_at: float = 0.0
+    last_update_at: float = 0.0
+
+
+class BatchStore:
+    """Pending batches, update inbox and disk commitments, shared between worker processes.
+
+    The connection is opened lazily so that every process (including spawned
+    workers) gets its own handle on the WAL database. Calls may wait on other
+    processes' locks, so async code runs them via ``asyncio.to_thread``; a lock
+    serializes the threads of one process on the connection.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _row_to_batch(self, row: tuple) -> PendingBatch:
+        group_key, chat_id, owner_user_id, files, prompt_message_id, created_at, last_update_at = row
+        return PendingBatch(
+            chat_id=chat_id,
+            owner_user_id=owner_user_id,
+            group_key=group_key,
+            files=[types.Document.model_validate(f) for f in json.loads(files)],
+            prompt_message_id=prompt_message_id,
+            created_at=created_at,
+            last_update_at=last_update_at,
+        )
+
+    def _select(self, group_key: str) -> PendingBatch | None:
+        row = self.conn.execute(
+            "SELECT group_key, chat_id, owner_user_id, files, prompt_message_id, created_at, last_update_at "
+            "FROM pending_batches WHERE group_key = ?",
+            (group_key,),
+        ).fetchone()
+        return self._row_to_batch(row) if row else None
+
+    @_locked
+    def get(self, group_key: str) -> PendingBatch | None:
+        return self._select(group_key)
+
+    @_locked
+    def add_file(
+        self, group_key: str, chat_id: int, owner_user_id: int, document: types.Document
+    ) -> PendingBatch:
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            batch = self._select(group_key)
+            if batch is None:
+                batch = PendingBatch(
+                    chat_id=chat_id,
+                    owner_user_id=owner_user_id,
+                    group_key=group_key,
+                    files=[],
+                    created_at=now,
+                )
+            batch.files.append(document)
+            batch.last_update_at = now
+            files = json.dumps([f.model_dump(mode="json", exclude_none=True) for f in batch.files])
+            self.conn.execute(
+                "INSERT INTO pending_batches "
+                "(group_key, chat_id, owner_user_id, files, prompt_message_id, created_at, last_update_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(group_key) DO UPDATE SET files = excluded.files, last_update_at = excluded.last_update_at",
+                (
+                    group_key,
+                    batch.chat_id,
+                    batch.owner_user_id,
+                    files,
+                    batch.prompt_message_id,
+                    batch.created_at,
+                    batch.last_update_at,
+                ),
+            )
+        return batch
+
+    @_locked
+    def set_prompt_message_id(self, group_key: str, message_id: int) -> None:
+        self.conn.execute(
+            "UPDATE pending_batches SET prompt_message_id = ? WHERE group_key = ?",
+            (message_id, group_key),
+        )
+
+    @_locked
+    def pop(self, group_key: str) -> PendingBatch | None:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            batch = self._select(group_key)
+            if batch is not None:
+                self.conn.execute("DELETE FROM pending_batches WHERE group_key = ?", (group_key,))
+        return batch
+
+    @_locked
+    def pop_expired(self, ttl_seconds: float) -> list[str]:
+        cutoff = time.time() - ttl_seconds
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            keys = [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT group_key FROM pending_batches WHERE created_at < ?", (cutoff,)
+                )
+            ]
+            self.conn.execute("DELETE FROM pending_batches WHERE created_at < ?", (cutoff,))
+            self.conn.execute(
+                "DELETE FROM processed_updates WHERE processed_at < ?",
+                (time.time() - _PROCESSED_UPDATES_TTL_SECONDS,),
+            )
+        return keys
+
+    @_locked
+    def enqueue_updates(self, updates: list[tuple[int, int, str]]) -> list[tuple[int, int, str]]:
+        """Store ``(update_id, chat_id, payload)`` updates until ``finish_updates``.
+
+        Returns those that were neither processed nor pending before.
+        """
+        new_updates: list[tuple[int, int, str]] = []
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for update_id, chat_id, payload in updates:
+                if self.conn.execute(
+                    "SELECT 1 FROM processed_updates WHERE update_id = ?", (update_id,)
+                ).fetchone():
+                    continue
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO pending_updates (update_id, chat_id, payload) VALUES (?, ?, ?)",
+                    (update_id, chat_id, payload),
+                )
+                if cursor.rowcount == 1:
+                    new_updates.append((update_id, chat_id, payload))
+        return new_updates
+
+    @_locked
+    def finish_updates(self, update_ids: list[int]) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "DELETE FROM pending_updates WHERE update_id = ?", [(update_id,) for update_id in update_ids]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)",
+                [(update_id, now) for update_id in update_ids],
+            )
+
+    @_locked
+    def pending_updates(self) -> list[tuple[int, int, str]]:
+        return self.conn.execute(
+            "SELECT update_id, chat_id, payload FROM pending_updates ORDER BY update_id"
+        ).fetchall()
+
+    @_locked
+    def reserve_disk_space(
+        self, device: int, free_bytes: int, observed_at: float, size: int, force: bool
+    ) -> tuple[bool, int]:
+        """Commit ``size`` bytes on ``device`` if they fit into free space (or ``force``).
+
+        ``free_bytes`` is a statvfs reading taken at ``observed_at``; readings older
+        than the last stored one are ignored. The drop in free space since the last
+        reading is charged once, oldest commitment first, and whatever the
+        commitments still hold is subtracted from free space. Returns whether the
+        batch was admitted and the space available before it.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute(
+                "DELETE FROM disk_commitments WHERE committed_at < ?",
+                (now - _DISK_COMMITMENT_TTL_SECONDS,),
+            )
+            row = self.conn.execute(
+                "SELECT free_bytes, observed_at FROM disk_free WHERE device = ?", (device,)
+            ).fetchone()
+            if row is not None and row[1] >= observed_at:
+                free_bytes = row[0]
+            else:
+                drop = max(0, row[0] - free_bytes) if row is not None else 0
+                self.conn.execute(
+                    "INSERT INTO disk_free (device, free_bytes, observed_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(device) DO UPDATE SET "
+                    "free_bytes = excluded.free_bytes, observed_at = excluded.observed_at",
+                    (device, free_bytes, observed_at),
+                )
+                self._charge_commitments(device, drop)
+
+            outstanding = self.conn.execute(
+                "SELECT COALESCE(SUM(remaining), 0) FROM disk_commitments WHERE device = ?", (device,)
+            ).fetchone()[0]
+            available = max(0, free_bytes - outstanding)
+            admitted = force or size <= available
+            if admitted and size > 0:
+                self.conn.execute(
+                    "INSERT INTO disk_commitments (device, remaining, committed_at) VALUES (?, ?, ?)",
+                    (device, size, now),
+                )
+        return admitted, available
+
+    def _charge_commitments(self, device: int, drop: int) -> None:
+        rows = self.conn.execute(
+            "SELECT id, remaining FROM disk_commitments WHERE device = ? ORDER BY committed_at, id",
+            (device,),
+        ).fetchall()
+        for commitment_id, remaining in rows:
+            if drop <= 0:
+                break
+            charged = min(drop, remaining)
+            drop -= charged
+            if charged == remaining:
+                self.conn.execute("DELETE FROM disk_commitments WHERE id = ?", (commitment_id,))
+            else:
+                self.conn.execute(
+                    "UPDATE disk_commitments SET remaining = ? WHERE id = ?",
+                    (remaining - charged, commitment_id),
+                )
+
+
+batch_store = BatchStore(settings.STATE_DB)
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -6,6 +8,10 @@ class Settings(BaseSettings):
     TOKEN: SecretStr
     ADMIN_IDS: list[int]
     TORRENT_DIR: str = "/mnt/foundation/torrents/incoming"
+    DISK_SPACE_POLICY: Literal["warn", "confirm", "reject"] = "confirm"
+    WORKERS: int = 1
+    STATE_DB: str = "state.db"
+    BOT_API_URL: str | None = None
 
     model_config = SettingsConfigDict(
         env_file='.env',
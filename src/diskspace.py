@@ -0,0 +1,73 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from src.batch_store import batch_store
+
+_STATVFS_TTL_SECONDS = 30.0
+
+
+@dataclass
+class _FreeSpace:
+    free_bytes: int
+    checked_at_monotonic: float
+    # Wall clock, so that readings from different processes can be ordered.
+    observed_at: float
+
+
+class DiskBudget:
+    """Admits batches against free space per filesystem, keyed by ``st_dev``.
+
+    ``os.statvfs`` is called at most once per TTL per filesystem and process, and
+    ``os.stat`` once per destination directory.
+    Commitments of admitted batches live in ``batch_store`` so that every worker
+    process sees them.
+    """
+
+    def __init__(self) -> None:
+        self._devices: dict[Path, int] = {}
+        self._free_space: dict[int, _FreeSpace] = {}
+
+    def _device(self, path: Path) -> int:
+        device = self._devices.get(path)
+        if device is None:
+            device = os.stat(path).st_dev
+            self._devices[path] = device
+        return device
+
+    def _free_space_of(self, path: Path, device: int) -> _FreeSpace:
+        cached = self._free_space.get(device)
+        now = time.monotonic()
+        if cached is None or now - cached.checked_at_monotonic > _STATVFS_TTL_SECONDS:
+            stat = os.statvfs(path)
+            cached = _FreeSpace(stat.f_bavail * stat.f_frsize, now, time.time())
+            self._free_space[device] = cached
+        return cached
+
+    def reserve(self, path: Path, size: int, force: bool = False) -> tuple[bool, int]:
+        """Commit ``size`` bytes on ``path``'s filesystem if they fit (or ``force``).
+
+        Returns whether the batch was admitted and the space available before it.
+        """
+        device = self._device(path)
+        free_space = self._free_space_of(path, device)
+        admitted, available = batch_store.reserve_disk_space(
+            device, free_space.free_bytes, free_space.observed_at, size, force
+        )
+        if admitted and size > 0:
+            logging.info(f"Committed {size} bytes on {path}")
+        return admitted, available
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.2f} {unit}"
+        value /= 1024
+    return f"{value:.2f} TB"
+
+
+disk_budget = DiskBudget()
@@ -0,0 +1,310 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Literal
+
+from aiogram import Bot, types
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiohttp import ClientError, ClientResponseError
+
+BreakerState = Literal["closed", "open", "half_open"]
+
+_MAX_ATTEMPTS = 5
+_BACKOFF_BASE_SECONDS = 0.5
+_BACKOFF_MAX_SECONDS = 30.0
+_RETRY_AFTER_MAX_SECONDS = 10.0
+_FILE_PATH_TTL_SECONDS = 50 * 60
+_BREAKER_FAILURE_THRESHOLD = 5
+_BREAKER_OPEN_SECONDS = 30.0
+_RECENT_RESULTS_LIMIT = 50
+
+
+class DownloadPaused(Exception):
+    """Raised when the circuit breaker is open and the download was not attempted."""
+
+
+@dataclass
+class DownloadResult:
+    file_name: str
+    ok: bool
+    attempts: int
+    latency_seconds: float
+    error: str | None = None
+    data: bytes | None = field(default=None, repr=False)
+
+
+@dataclass
+class _DeferredDownload:
+    bot: Bot
+    document: types.Document
+    destination: Path
+    chat_id: int
+    # Stores the downloaded bytes in a thread; returns why the file was not saved, or None.
+    save: Callable[[bytes], str | None]
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, open_seconds: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state: BreakerState = "closed"
+        self._consecutive_failures = 0
+        self._opened_at_monotonic = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self._opened_at_monotonic < self.open_seconds:
+                return False
+            self.state = "half_open"
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def seconds_until_retry(self) -> float:
+        if self.state != "open":
+            return 0.0
+        elapsed = time.monotonic() - self._opened_at_monotonic
+        return max(0.0, self.open_seconds - elapsed)
+
+    def release_probe(self) -> None:
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logging.info("Download circuit breaker closed.")
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logging.warning(
+                    f"Download circuit breaker opened after {self._consecutive_failures} failures."
+                )
+            self.state = "open"
+            self._opened_at_monotonic = time.monotonic()
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, TelegramRetryAfter)):
+        return True
+    if isinstance(error, ClientResponseError):
+        return error.status in {404, 408, 429} or error.status >= 500
+    return isinstance(error, (ClientError, asyncio.TimeoutError, ConnectionError))
+
+
+def _is_telegram_response(error: Exception) -> bool:
+    return isinstance(error, (TelegramAPIError, ClientResponseError))
+
+
+def _is_expired_file_path(error: Exception) -> bool:
+    return isinstance(error, ClientResponseError) and error.status == 404
+
+
+def _backoff_delay(attempt: int) -> float:
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)].
+    cap = min(_BACKOFF_MAX_SECONDS, _BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+class DownloadEngine:
+    """Retries downloads behind a circuit breaker and queues files while it is open.
+
+    State is per process: with ``WORKERS > 1`` each worker has its own breaker and
+    queue, and trips it on the failures it sees itself.
+    """
+
+    def __init__(self) -> None:
+        self.breaker = CircuitBreaker(_BREAKER_FAILURE_THRESHOLD, _BREAKER_OPEN_SECONDS)
+        self.recent_results: deque[DownloadResult] = deque(maxlen=_RECENT_RESULTS_LIMIT)
+        self._deferred: deque[_DeferredDownload] = deque()
+        self._resume_task: asyncio.Task[None] | None = None
+
+    @property
+    def deferred_count(self) -> int:
+        return len(self._deferred)
+
+    async def download(self, bot: Bot, document: types.Document, file_name: str) -> DownloadResult:
+        """Download ``document`` into memory with retries.
+
+        Raises ``DownloadPaused`` if the breaker is open before the first attempt or
+        trips while retrying; the caller is expected to ``defer`` the file.
+        """
+        started = time.monotonic()
+        attempts = 0
+        file_path: str | None = None
+        file_path_fetched_at = 0.0
+        refetched_after_404 = False
+        last_error: Exception | None = None
+
+        while attempts < _MAX_ATTEMPTS:
+            if not self.breaker.allow():
+                raise DownloadPaused(file_name)
+
+            attempts += 1
+            try:
+                if file_path is None or time.monotonic() - file_path_fetched_at > _FILE_PATH_TTL_SECONDS:
+                    telegram_file = await bot.get_file(document.file_id)
+                    file_path = telegram_file.file_path
+                    file_path_fetched_at = time.monotonic()
+                buffer = await bot.download_file(file_path)
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                last_error = e
+                if not _is_transient(e):
+                    # Only an answer from Telegram says anything about its health.
+                    if _is_telegram_response(e):
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.release_probe()
+                    break
+                file_path_expired = _is_expired_file_path(e)
+                if file_path_expired and not refetched_after_404:
+                    # An expired path is not an outage: refetch getFile once before
+                    # counting 404s against the breaker.
+                    refetched_after_404 = True
+                    self.breaker.release_probe()
+                else:
+                    self.breaker.record_failure()
+                if file_path_expired:
+                    file_path = None
+                logging.warning(f"Download attempt {attempts} for {file_name} failed: {e}")
+                if attempts >= _MAX_ATTEMPTS:
+                    break
+                if isinstance(e, TelegramRetryAfter):
+                    delay = min(float(e.retry_after), _RETRY_AFTER_MAX_SECONDS)
+                else:
+                    delay = _backoff_delay(attempts)
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return self._record(
+                DownloadResult(file_name, True, attempts, time.monotonic() - started, data=buffer.getvalue())
+            )
+
+        return self._record(
+            DownloadResult(file_name, False, attempts, time.monotonic() - started, error=str(last_error))
+        )
+
+    def is_deferred(self, destination: Path) -> bool:
+        return any(item.destination == destination for item in self._deferred)
+
+    def defer(
+        self,
+        bot: Bot,
+        document: types.Document,
+        destination: Path,
+        chat_id: int,
+        save: Callable[[bytes], str | None],
+    ) -> None:
+        self._deferred.append(_DeferredDownload(bot, document, destination, chat_id, save))
+        if self._resume_task is None or self._resume_task.done():
+            self._resume_task = asyncio.create_task(self._resume_deferred())
+
+    async def _resume_deferred(self) -> None:
+        # Files deferred while summaries are being sent are picked up by the next round.
+        while self._deferred:
+            await self._drain_deferred()
+
+    async def _drain_deferred(self) -> None:
+        bots: dict[int, Bot] = {}
+        saved: dict[int, list[str]] = {}
+        skipped: dict[int, list[str]] = {}
+        errors: dict[int, list[str]] = {}
+
+        while self._deferred:
+            await asyncio.sleep(max(1.0, self.breaker.seconds_until_retry()))
+            while self._deferred:
+                item = self._deferred[0]
+                if item.destination.exists():
+                    self._deferred.popleft()
+                    bots[item.chat_id] = item.bot
+                    skipped.setdefault(item.chat_id, []).append(item.destination.name)
+                    continue
+                file_name = item.destination.name
+                try:
+                    result = await self.download(item.bot, item.document, file_name)
+                    if result.ok:
+                        reason = await asyncio.to_thread(item.save, result.data)
+                    else:
+                        reason = "download failed"
+                except DownloadPaused:
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error(f"Unable to resume download {file_name}: {e}")
+                    reason = "error"
+                self._deferred.popleft()
+                bots[item.chat_id] = item.bot
+                if reason is None:
+                    saved.setdefault(item.chat_id, []).append(file_name)
+                else:
+                    errors.setdefault(item.chat_id, []).append(f"{file_name} ({reason})")
+
+        for chat_id, bot in bots.items():
+            chat_saved = saved.get(chat_id, [])
+            chat_skipped = skipped.get(chat_id, [])
+            chat_errors = errors.get(chat_id, [])
+            text = (
+                f"Resumed downloads: saved {len(chat_saved)}, "
+                f"skipped {len(chat_skipped)} (duplicates), errors {len(chat_errors)}."
+            )
+            if chat_errors:
+                text += "\nFailed: " + ", ".join(chat_errors)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except Exception as e:
+                logging.error(f"Unable to send resume summary to {chat_id}: {e}")
+
+    def _record(self, result: DownloadResult) -> DownloadResult:
+        # Only the stats are kept; the payload belongs to the caller.
+        self.recent_results.append(replace(result, data=None))
+        logging.info(
+            f"Download {result.file_name}: ok={result.ok} attempts={result.attempts} "
+            f"latency={result.latency_seconds:.2f}s"
+        )
+        return result
+
+    def stats_text(self) -> str:
+        results = list(self.recent_results)
+        lines = [
+            f"Breaker: {self.breaker.state}",
+            f"Queued: {self.deferred_count}",
+        ]
+        if results:
+            ok_count = sum(1 for r in results if r.ok)
+            avg_attempts = sum(r.attempts for r in results) / len(results)
+            avg_latency = sum(r.latency_seconds for r in results) / len(results)
+            lines.append(
+                f"Last {len(results)}: ok {ok_count}, avg attempts {avg_attempts:.2f}, "
+                f"avg latency {avg_latency:.2f}s"
+            )
+            lines.append("")
+            for r in results[-10:]:
+                status = "ok" if r.ok else "error"
+                lines.append(f"- {r.file_name}: {status}, {r.attempts} attempts, {r.latency_seconds:.2f}s")
+        return "\n".join(lines)
+
+
+download_engine = DownloadEngine()
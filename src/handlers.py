@@ -1,7 +1,9 @@
 import asyncio
+import html
+import io
 import logging
-import time
-from dataclasses import dataclass
+import os
+from functools import partial
 from pathlib import Path
 from typing import Literal
 
@@ -12,8 +14,11 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from datetime import datetime, timezone
 
+from src.batch_store import batch_store
 from src.config import settings
-from src.utils import get_torrent_info, get_uptime_message
+from src.diskspace import disk_budget, format_size
+from src.downloader import DownloadPaused, download_engine
+from src.utils import get_torrent_info, get_torrent_payload_size, get_uptime_message
 
 router = Router()
 
@@ -23,32 +28,18 @@ _BATCH_DEBOUNCE_SECONDS = 1.0
 _BATCH_TTL_SECONDS = 60 * 60
 
 
-@dataclass
-class PendingBatch:
-    chat_id: int
-    owner_user_id: int
-    group_key: str
-    files: list[types.Document]
-    prompt_message_id: int | None = None
-    prompt_task: asyncio.Task[None] | None = None
-    created_at_monotonic: float = 0.0
-    last_update_monotonic: float = 0.0
+_prompt_tasks: dict[str, asyncio.Task[None]] = {}
 
 
-_pending_batches: dict[str, PendingBatch] = {}
+def _cancel_prompt_task(group_key: str) -> None:
+    prompt_task = _prompt_tasks.pop(group_key, None)
+    if prompt_task and not prompt_task.done():
+        prompt_task.cancel()
 
 
-def _cleanup_expired_batches() -> None:
-    now = time.monotonic()
-    expired_keys: list[str] = []
-    for key, batch in _pending_batches.items():
-        if now - batch.created_at_monotonic > _BATCH_TTL_SECONDS:
-            expired_keys.append(key)
-
-    for key in expired_keys:
-        batch = _pending_batches.pop(key, None)
-        if batch and batch.prompt_task and not batch.prompt_task.done():
-            batch.prompt_task.cancel()
+async def _cleanup_expired_batches() -> None:
+    for key in await asyncio.to_thread(batch_store.pop_expired, _BATCH_TTL_SECONDS):
+        _cancel_prompt_task(key)
 
 
 def _build_batch_keyboard(group_key: str) -> InlineKeyboardMarkup:
@@ -60,6 +51,14 @@ def _build_batch_keyboard(group_key: str) -> InlineKeyboardMarkup:
     return kb.as_markup()
 
 
+def _build_disk_confirm_keyboard(group_key: str, content_type: BatchType) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="💾 Save anyway", callback_data=f"tclass|{group_key}|force-{content_type}")
+    kb.button(text="✖️ Cancel", callback_data=f"tclass|{group_key}|cancel")
+    kb.adjust(1, 1)
+    return kb.as_markup()
+
+
 def _prompt_text(file_count: int) -> str:
     if file_count == 1:
         return "Got 1 .torrent file. Where should I put it?"
@@ -74,6 +73,29 @@ def _dest_subdir(content_type: BatchType) -> str:
     return "Movies" if content_type == "movies" else "Series"
 
 
+def _payload_size(file_name: str, data: bytes) -> int:
+    try:
+        return get_torrent_payload_size(io.BytesIO(data))
+    except Exception as e:
+        logging.warning(f"Unable to read payload size of {file_name}: {e}")
+        return 0
+
+
+def _write_torrent(path: Path, data: bytes) -> None:
+    partial_path = path.with_name(path.name + ".part")
+    partial_path.write_bytes(data)
+    os.replace(partial_path, path)
+
+
+def _save_deferred_torrent(target_path: Path, force: bool, data: bytes) -> str | None:
+    payload_size = _payload_size(target_path.name, data)
+    admitted, available = disk_budget.reserve(target_path.parent, payload_size, force=force)
+    if not admitted:
+        return f"needs {format_size(payload_size)}, only {format_size(available)} free"
+    _write_torrent(target_path, data)
+    return None
+
+
 @router.message(CommandStart(), F.from_user.id.in_(settings.ADMIN_IDS))
 async def cmd_start(message: Message) -> None:
     uptime = get_uptime_message()
@@ -93,34 +115,19 @@ async def handle_torrent_file(message: Message, bot: Bot) -> None:
         await message.answer("Only .torrent files are supported.")
         return
 
-    _cleanup_expired_batches()
+    await _cleanup_expired_batches()
 
     if message.media_group_id:
         group_key = f"mg:{message.chat.id}:{message.media_group_id}"
     else:
         group_key = f"msg:{message.chat.id}:{message.message_id}"
 
-    now = time.monotonic()
-    batch = _pending_batches.get(group_key)
-    if not batch:
-        batch = PendingBatch(
-            chat_id=message.chat.id,
-            owner_user_id=message.from_user.id,
-            group_key=group_key,
-            files=[],
-            created_at_monotonic=now,
-            last_update_monotonic=now,
-        )
-        _pending_batches[group_key] = batch
-    else:
-        batch.last_update_monotonic = now
-
-    batch.files.append(document)
-
-    if batch.prompt_task and not batch.prompt_task.done():
-        batch.prompt_task.cancel()
+    batch = await asyncio.to_thread(
+        batch_store.add_file, group_key, message.chat.id, message.from_user.id, document
+    )
 
-    batch.prompt_task = asyncio.create_task(_send_batch_prompt(bot, batch.group_key))
+    _cancel_prompt_task(group_key)
+    _prompt_tasks[group_key] = asyncio.create_task(_send_batch_prompt(bot, batch.group_key))
 
     if batch.prompt_message_id is not None:
         try:
@@ -136,7 +143,7 @@ async def handle_torrent_file(message: Message, bot: Bot) -> None:
 
 async def _send_batch_prompt(bot: Bot, group_key: str) -> None:
     await asyncio.sleep(_BATCH_DEBOUNCE_SECONDS)
-    batch = _pending_batches.get(group_key)
+    batch = await asyncio.to_thread(batch_store.get, group_key)
     if not batch:
         return
     if batch.prompt_message_id is not None:
@@ -148,17 +155,17 @@ async def _send_batch_prompt(bot: Bot, group_key: str) -> None:
             text=_prompt_text(len(batch.files)),
             reply_markup=_build_batch_keyboard(batch.group_key),
         )
-        batch.prompt_message_id = msg.message_id
+        await asyncio.to_thread(batch_store.set_prompt_message_id, group_key, msg.message_id)
     except asyncio.CancelledError:
         raise
     except Exception as e:
         logging.error(f"Unable to send batch prompt: {e}")
-        _pending_batches.pop(group_key, None)
+        await asyncio.to_thread(batch_store.pop, group_key)
 
 
 @router.callback_query(F.data.startswith("tclass|"), F.from_user.id.in_(settings.ADMIN_IDS))
 async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
-    _cleanup_expired_batches()
+    await _cleanup_expired_batches()
 
     parts = (callback.data or "").split("|", 2)
     if len(parts) != 3:
@@ -166,7 +173,7 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
         return
 
     _, group_key, action = parts
-    batch = _pending_batches.get(group_key)
+    batch = await asyncio.to_thread(batch_store.get, group_key)
     if not batch:
         await callback.answer("This batch is already processed or expired.", show_alert=True)
         try:
@@ -183,7 +190,8 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
         return
 
     if action == "cancel":
-        _pending_batches.pop(group_key, None)
+        await asyncio.to_thread(batch_store.pop, group_key)
+        _cancel_prompt_task(group_key)
         await callback.answer("Canceled.")
         if callback.message:
             try:
@@ -192,6 +200,10 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
                 pass
         return
 
+    force = action.startswith("force-")
+    if force:
+        action = action.removeprefix("force-")
+
     if action not in {"movies", "series"}:
         await callback.answer("Unknown action.", show_alert=True)
         return
@@ -204,9 +216,15 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
         await callback.answer("Can't create destination folder.", show_alert=True)
         return
 
+    # Downloads may retry for a while; answer now before the query goes stale.
+    await callback.answer("Downloading…")
+
+    downloaded: dict[str, bytes] = {}
     saved: list[str] = []
     skipped: list[str] = []
     errors: list[str] = []
+    paused: list[tuple[types.Document, Path]] = []
+    queued: list[str] = []
     seen_names: set[str] = set()
 
     for document in batch.files:
@@ -225,24 +243,87 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
             skipped.append(safe_name)
             continue
 
+        if download_engine.is_deferred(target_path):
+            queued.append(safe_name)
+            continue
+
         try:
-            await bot.download(document, destination=target_path)
-            saved.append(safe_name)
+            result = await download_engine.download(bot, document, safe_name)
+        except DownloadPaused:
+            paused.append((document, target_path))
+            continue
         except Exception as e:
             logging.error(f"Unable to save file {safe_name}: {e}")
             errors.append(safe_name)
+            continue
+
+        if result.ok:
+            downloaded[safe_name] = result.data
+        else:
+            logging.error(f"Unable to save file {safe_name}: {result.error}")
+            errors.append(safe_name)
+
+    payload_size = sum(_payload_size(name, data) for name, data in downloaded.items())
+    force = force or settings.DISK_SPACE_POLICY == "warn"
 
-    _pending_batches.pop(group_key, None)
+    disk_warning: str | None = None
+    try:
+        admitted, available = await asyncio.to_thread(disk_budget.reserve, dest_dir, payload_size, force)
+    except OSError as e:
+        logging.error(f"Unable to check free space on {dest_dir}: {e}")
+        admitted, available = True, None
+
+    if available is not None and payload_size > available:
+        disk_warning = (
+            f"Batch needs {format_size(payload_size)}, "
+            f"only {format_size(available)} free in {dest_dir}."
+        )
 
-    await callback.answer("Готово.")
+    if not admitted:
+        if settings.DISK_SPACE_POLICY == "reject":
+            await asyncio.to_thread(batch_store.pop, group_key)
+            _cancel_prompt_task(group_key)
+            text = f"Rejected. {disk_warning}"
+            if paused:
+                text += f" Also dropped {len(paused)} waiting for Telegram."
+            reply_markup = None
+        else:
+            text = f"{disk_warning} Save anyway?"
+            reply_markup = _build_disk_confirm_keyboard(group_key, action)
+
+        if callback.message:
+            try:
+                await callback.message.edit_text(text, reply_markup=reply_markup)
+            except Exception:
+                pass
+        return
+
+    # Files that could not be downloaded yet are queued only once the batch is
+    # admitted, so a rejected or canceled batch leaves nothing behind.
+    for document, target_path in paused:
+        download_engine.defer(
+            bot, document, target_path, batch.chat_id, partial(_save_deferred_torrent, target_path, force)
+        )
+        queued.append(target_path.name)
+
+    for name, data in downloaded.items():
+        try:
+            _write_torrent(dest_dir / name, data)
+            saved.append(name)
+        except Exception as e:
+            logging.error(f"Unable to save file {name}: {e}")
+            errors.append(name)
+
+    await asyncio.to_thread(batch_store.pop, group_key)
+    _cancel_prompt_task(group_key)
 
     if callback.message:
         try:
             pretty_type = _dest_subdir(action)
-            await callback.message.edit_text(
-                f"{pretty_type}: saved {len(saved)}, skipped {len(skipped)} (duplicates), errors {len(errors)}.",
-                reply_markup=None,
-            )
+            summary = f"{pretty_type}: saved {len(saved)}, skipped {len(skipped)} (duplicates), errors {len(errors)}."
+            if queued:
+                summary += f" Queued {len(queued)} until Telegram recovers."
+            await callback.message.edit_text(summary, reply_markup=None)
         except Exception:
             pass
 
@@ -255,6 +336,12 @@ async def classify_batch(callback: types.CallbackQuery, bot: Bot) -> None:
             ]
             if errors:
                 lines.append(f"Errors: {len(errors)}")
+            if queued:
+                lines.append(
+                    f"Queued (Telegram unavailable): {len(queued)}, disk space is checked when they resume"
+                )
+            if disk_warning:
+                lines.append(f"Warning: {disk_warning}")
 
             if len(batch.files) == 1 and saved:
                 file_path = dest_dir / saved[0]
@@ -295,3 +382,8 @@ async def cmd_health(message: Message):
         "<pre>/health accepted. Running host healthcheck...</pre>",
         parse_mode="HTML",
     )
+
+
+@router.message(Command("downloads"), F.from_user.id.in_(settings.ADMIN_IDS))
+async def cmd_downloads(message: Message):
+    await message.answer(f"<pre>{html.escape(download_engine.stats_text())}</pre>", parse_mode="HTML")
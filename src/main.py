@@ -4,26 +4,51 @@ import sys
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
 from src.config import settings
 from src.handlers import router, notify_admin
+from src.sharding import run_sharded_polling
 
 async def on_startup(bot: Bot):
     await notify_admin(bot, "Bot started.")
     logging.info("Bot started.")
 
-async def main():
+def setup_logging():
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
         stream=sys.stdout
     )
 
-    bot = Bot(token=settings.TOKEN.get_secret_value(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+def create_bot() -> Bot:
+    session = None
+    if settings.BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(settings.BOT_API_URL))
+    return Bot(
+        token=settings.TOKEN.get_secret_value(),
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+def create_dispatcher() -> Dispatcher:
     dp = Dispatcher()
-    
     dp.include_router(router)
+    return dp
+
+async def main():
+    setup_logging()
+
+    bot = create_bot()
+
+    if settings.WORKERS > 1:
+        await on_startup(bot)
+        await run_sharded_polling(bot, settings.WORKERS)
+        return
+
+    dp = create_dispatcher()
     dp.startup.register(on_startup)
 
     await dp.start_polling(bot)
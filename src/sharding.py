@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import sqlite3
+from collections.abc import Iterable
+from functools import partial
+from multiprocessing.context import BaseContext
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from src.batch_store import batch_store
+
+_POLL_TIMEOUT_SECONDS = 30
+_POLL_ERROR_DELAY_SECONDS = 1.0
+_WORKER_JOIN_TIMEOUT_SECONDS = 10.0
+
+
+def update_chat_id(update: Update) -> int:
+    message = update.message or update.edited_message
+    if message:
+        return message.chat.id
+    if update.callback_query:
+        if update.callback_query.message:
+            return update.callback_query.message.chat.id
+        return update.callback_query.from_user.id
+    return 0
+
+
+def shard_for(chat_id: int, worker_count: int) -> int:
+    return chat_id % worker_count
+
+
+async def run_sharded_polling(bot: Bot, worker_count: int) -> None:
+    """Poll updates in this process and hand them to ``worker_count`` processes.
+
+    Updates are deduplicated against ``batch_store`` and routed by chat id, so
+    every chat is served by a single worker, which handles its updates in the
+    order Telegram delivered them while other chats run concurrently. Batch
+    state lives in ``batch_store``, which all workers share.
+
+    An update stays pending in ``batch_store`` until its worker has handled it.
+    Workers that die are restarted and get their pending updates again, as do
+    all workers after a restart of the bot, so updates are handled at least once.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queues: list[Queue] = [ctx.Queue() for _ in range(worker_count)]
+    workers = [_start_worker(ctx, index, queue) for index, queue in enumerate(queues)]
+    logging.info(f"Started {worker_count} update workers.")
+
+    offset: int | None = None
+    try:
+        await _resend_pending(queues, range(worker_count))
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=_POLL_TIMEOUT_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Unable to get updates: {e}")
+                await asyncio.sleep(_POLL_ERROR_DELAY_SECONDS)
+                continue
+
+            restarted = _restart_dead_workers(ctx, workers, queues)
+            if restarted:
+                await _resend_pending(queues, restarted)
+            if not updates:
+                continue
+
+            try:
+                new_updates = await asyncio.to_thread(
+                    batch_store.enqueue_updates,
+                    [
+                        (
+                            update.update_id,
+                            update_chat_id(update),
+                            update.model_dump_json(exclude_unset=True, by_alias=True),
+                        )
+                        for update in updates
+                    ],
+                )
+            except sqlite3.Error as e:
+                # The offset stays put, so Telegram sends the same updates again.
+                logging.error(f"Unable to store updates: {e}")
+                await asyncio.sleep(_POLL_ERROR_DELAY_SECONDS)
+                continue
+
+            _put_updates(queues, new_updates)
+            offset = updates[-1].update_id + 1
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for worker in workers:
+            await asyncio.to_thread(worker.join, _WORKER_JOIN_TIMEOUT_SECONDS)
+            if worker.is_alive():
+                worker.terminate()
+        await bot.session.close()
+
+
+def _start_worker(ctx: BaseContext, index: int, queue: Queue) -> BaseProcess:
+    worker = ctx.Process(target=_worker_main, args=(index, queue), name=f"worker-{index}", daemon=True)
+    worker.start()
+    return worker
+
+
+def _restart_dead_workers(ctx: BaseContext, workers: list[BaseProcess], queues: list[Queue]) -> list[int]:
+    restarted: list[int] = []
+    for index, worker in enumerate(workers):
+        if worker.is_alive():
+            continue
+        # The dead worker may still hold the queue's read lock; its pending updates are resent.
+        logging.error(f"Worker {index} exited with code {worker.exitcode}, restarting with a new queue.")
+        queues[index] = ctx.Queue()
+        workers[index] = _start_worker(ctx, index, queues[index])
+        restarted.append(index)
+    return restarted
+
+
+def _put_updates(queues: list[Queue], updates: list[tuple[int, int, str]]) -> None:
+    shards: dict[int, list[tuple[int, str]]] = {}
+    for _, chat_id, raw_update in updates:
+        shards.setdefault(shard_for(chat_id, len(queues)), []).append((chat_id, raw_update))
+    for shard, items in shards.items():
+        queues[shard].put(items)
+
+
+async def _resend_pending(queues: list[Queue], shards: Iterable[int]) -> None:
+    wanted_shards = set(shards)
+    while True:
+        try:
+            pending = await asyncio.to_thread(batch_store.pending_updates)
+            break
+        except sqlite3.Error as e:
+            logging.error(f"Unable to load pending updates: {e}")
+            await asyncio.sleep(_POLL_ERROR_DELAY_SECONDS)
+    pending = [item for item in pending if shard_for(item[1], len(queues)) in wanted_shards]
+    if pending:
+        logging.info(f"Resending {len(pending)} pending updates.")
+        _put_updates(queues, pending)
+
+
+def _worker_main(index: int, queue: Queue) -> None:
+    from src.main import setup_logging
+
+    setup_logging()
+    try:
+        asyncio.run(_run_worker(index, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+class _HandledUpdates:
+    """Marks handled updates in ``batch_store``, all that piled up in one transaction."""
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self._update_ids: list[int] = []
+        self._wakeup = asyncio.Event()
+
+    def add(self, update_id: int) -> None:
+        self._update_ids.append(update_id)
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        update_ids, self._update_ids = self._update_ids, []
+        if not update_ids:
+            return
+        try:
+            await asyncio.to_thread(batch_store.finish_updates, update_ids)
+        except sqlite3.Error as e:
+            # Still pending: retried with the next batch, or resent if this worker is restarted.
+            logging.error(f"Worker {self.index} failed to mark {len(update_ids)} updates as handled: {e}")
+            self._update_ids[:0] = update_ids
+
+
+async def _handle_update(
+    dp: Dispatcher,
+    bot: Bot,
+    index: int,
+    update: dict,
+    previous: asyncio.Task[None] | None,
+    handled: _HandledUpdates,
+) -> None:
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception as e:
+        logging.error(f"Worker {index} failed to handle update {update['update_id']}: {e}")
+    handled.add(update["update_id"])
+
+
+def _forget_chat_tail(chat_tails: dict[int, asyncio.Task[None]], chat_id: int, task: asyncio.Task[None]) -> None:
+    if chat_tails.get(chat_id) is task:
+        del chat_tails[chat_id]
+
+
+async def _run_worker(index: int, queue: Queue) -> None:
+    from src.main import create_bot, create_dispatcher
+
+    bot = create_bot()
+    dp = create_dispatcher()
+    # Last queued update per chat; the next one for that chat waits for it.
+    chat_tails: dict[int, asyncio.Task[None]] = {}
+    handled = _HandledUpdates(index)
+    handled_task = asyncio.create_task(handled.run())
+    me = await bot.me()
+    logging.info(f"Worker {index} started as @{me.username}.")
+
+    try:
+        while True:
+            items = await asyncio.to_thread(queue.get)
+            if items is None:
+                break
+
+            for chat_id, raw_update in items:
+                update = json.loads(raw_update)
+                task = asyncio.create_task(
+                    _handle_update(dp, bot, index, update, chat_tails.get(chat_id), handled)
+                )
+                chat_tails[chat_id] = task
+                task.add_done_callback(partial(_forget_chat_tail, chat_tails, chat_id))
+    finally:
+        if chat_tails:
+            await asyncio.gather(*chat_tails.values(), return_exceptions=True)
+        handled_task.cancel()
+        await handled.flush()
+        await bot.session.close()
+        logging.info(f"Worker {index} stopped.")
@@ -24,12 +24,23 @@ def get_uptime_message() -> str:
 
 
 
+def _payload_size(info: dict) -> int:
+    files = info.get('files', [])
+    return sum(f['length'] for f in files) if files else info.get('length', 0)
+
+
+def get_torrent_payload_size(file_path) -> int:
+    parser = TorrentFileParser(file_path)
+    data = parser.parse()
+    return _payload_size(data['info'])
+
+
 def get_torrent_info(file_path):
     parser = TorrentFileParser(file_path)
     data = parser.parse()
     name = data['info'].get('name', 'Unknown')
     files = data['info'].get('files', [])
-    total_size = sum(f['length'] for f in files) if files else data['info'].get('length', 0)
+    total_size = _payload_size(data['info'])
     formatted_files = "\n".join(
         [f"- {f['path'][0]} ({f['length'] / (1024 * 1024):.2f} MB)" for f in files]
     ) if files else f"- {name} ({total_size / (1024 * 1024):.2f} MB)"
@@ -0,0 +1,6 @@
+import os
+
+# src.config reads these at import time.
+os.environ.setdefault("TOKEN", "42:test")
+os.environ.setdefault("ADMIN_IDS", "[1]")
+os.environ.setdefault("STATE_DB", ":memory:")
@@ -0,0 +1,31 @@
+import pytest
+
+from src.batch_store import BatchStore
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BatchStore(str(tmp_path / "state.db"))
+
+
+def test_free_space_drop_is_charged_once_across_commitments(store):
+    assert store.reserve_disk_space(1, 1000 * GB, 1.0, 100 * GB, force=False) == (True, 1000 * GB)
+    assert store.reserve_disk_space(1, 1000 * GB, 1.0, 100 * GB, force=False) == (True, 900 * GB)
+
+    # The first torrent has been written: 100 GB of the 200 GB committed is still due.
+    assert store.reserve_disk_space(1, 900 * GB, 2.0, 0, force=False) == (True, 800 * GB)
+
+
+def test_stale_reading_does_not_undo_a_newer_one(store):
+    store.reserve_disk_space(1, 1000 * GB, 1.0, 100 * GB, force=False)
+    store.reserve_disk_space(1, 900 * GB, 3.0, 0, force=False)
+
+    assert store.reserve_disk_space(1, 1000 * GB, 2.0, 0, force=False) == (True, 900 * GB)
+
+
+def test_commitment_that_does_not_fit_is_rejected_unless_forced(store):
+    assert store.reserve_disk_space(1, 50 * GB, 1.0, 100 * GB, force=False) == (False, 50 * GB)
+    assert store.reserve_disk_space(1, 50 * GB, 1.0, 100 * GB, force=True) == (True, 50 * GB)
+    assert store.reserve_disk_space(1, 50 * GB, 1.0, 0, force=False) == (True, 0)